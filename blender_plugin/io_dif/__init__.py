@@ -153,6 +153,12 @@ class ImportCSX(bpy.types.Operator, ImportHelper):
         options={"HIDDEN"},
     )
 
+    validate_meshes: BoolProperty(
+        name="Validate Meshes",
+        description="Check the imported meshes and clean up invalid geometry, slower but needed for malformed files",
+        default=True,
+    )
+
     check_extension = True
 
     def execute(self, context):
@@ -175,7 +181,7 @@ class ImportCSX(bpy.types.Operator, ImportHelper):
         return import_csx.load(context, **keywords)
 
     def draw(self, context):
-        pass
+        self.layout.prop(self, "validate_meshes")
 
 
 class ImportDIF(bpy.types.Operator, ImportHelper):
@@ -191,6 +197,12 @@ class ImportDIF(bpy.types.Operator, ImportHelper):
         options={"HIDDEN"},
     )
 
+    validate_meshes: BoolProperty(
+        name="Validate Meshes",
+        description="Check the imported meshes and clean up invalid geometry, slower but needed for malformed files",
+        default=False,
+    )
+
     check_extension = True
 
     def execute(self, context):
@@ -213,7 +225,7 @@ class ImportDIF(bpy.types.Operator, ImportHelper):
         return import_dif.load(context, **keywords)
 
     def draw(self, context):
-        pass
+        self.layout.prop(self, "validate_meshes")
 
 
 class ExportDIF(bpy.types.Operator, ExportHelper):
@@ -8,6 +8,8 @@ import os
 import platform
 from pathlib import Path
 
+import numpy as np
+
 from bpy.types import Curve, Image, Material, Mesh, Object, ShaderNodeTexImage
 from bpy_extras.wm_utils.progress_report import ProgressReport, ProgressReportSubstep
 from mathutils import Quaternion, Vector
@@ -18,70 +20,80 @@ elif platform.system() == "Darwin":
     dllpath = os.path.join(os.path.dirname(os.path.realpath(__file__)), "DifBuilderLib.dylib")
 elif platform.system() == "Linux":
     dllpath = os.path.join(os.path.dirname(os.path.realpath(__file__)), "DifBuilderLib.so")
-difbuilderlib = None
-try:
-    difbuilderlib = ctypes.CDLL(dllpath)
-except:
-    raise Exception(
-        "There was an error loading the necessary dll required for dif export. Please download the plugin from the proper location: https://github.com/RandomityGuy/io_dif/releases"
-    )
+_difbuilderlib = None
 
 STATUSFN = ctypes.CFUNCTYPE(None, ctypes.c_bool, ctypes.c_uint32, ctypes.c_uint32, ctypes.c_char_p, ctypes.c_char_p)
 
-difbuilderlib.new_difbuilder.restype = ctypes.c_void_p
-difbuilderlib.dispose_difbuilder.argtypes = [ctypes.c_void_p]
-difbuilderlib.add_triangle.argtypes = [
-    ctypes.c_void_p,
-    ctypes.POINTER(ctypes.c_float),
-    ctypes.POINTER(ctypes.c_float),
-    ctypes.POINTER(ctypes.c_float),
-    ctypes.POINTER(ctypes.c_float),
-    ctypes.POINTER(ctypes.c_float),
-    ctypes.POINTER(ctypes.c_float),
-    ctypes.POINTER(ctypes.c_float),
-    ctypes.c_char_p,
-]
-difbuilderlib.build.argtypes = [ctypes.c_void_p, ctypes.c_bool, ctypes.c_int32, ctypes.c_float, ctypes.c_float, ctypes.c_float, STATUSFN]
-difbuilderlib.build.restype = ctypes.c_void_p
-
-difbuilderlib.dispose_dif.argtypes = [ctypes.c_void_p]
-difbuilderlib.write_dif.argtypes = [ctypes.c_void_p, ctypes.c_char_p]
-
-difbuilderlib.add_pathed_interior.argtypes = [
-    ctypes.c_void_p,
-    ctypes.c_void_p,
-    ctypes.c_void_p,
-]
-
-difbuilderlib.new_marker_list.restype = ctypes.c_void_p
-difbuilderlib.dispose_marker_list.argtypes = [ctypes.c_void_p]
-difbuilderlib.push_marker.argtypes = [
-    ctypes.c_void_p,
-    ctypes.POINTER(ctypes.c_float),
-    ctypes.c_int,
-    ctypes.c_int,
-]
-difbuilderlib.add_game_entity.argtypes = [
-    ctypes.c_void_p,
-    ctypes.c_char_p,
-    ctypes.c_char_p,
-    ctypes.POINTER(ctypes.c_float),
-    ctypes.c_void_p,
-]
-difbuilderlib.new_dict.restype = ctypes.c_void_p
-difbuilderlib.dispose_dict.argtypes = [ctypes.c_void_p]
-difbuilderlib.add_dict_kvp.argtypes = [
-    ctypes.c_void_p,
-    ctypes.c_char_p,
-    ctypes.c_char_p,
-]
-difbuilderlib.add_trigger.argtypes = [
-    ctypes.c_void_p,
-    ctypes.POINTER(ctypes.c_float),
-    ctypes.c_char_p,
-    ctypes.c_char_p,
-    ctypes.c_void_p,
-]
+
+def _lib():
+    global _difbuilderlib
+    if _difbuilderlib is not None:
+        return _difbuilderlib
+
+    try:
+        difbuilderlib = ctypes.CDLL(dllpath)
+    except:
+        raise Exception(
+            "There was an error loading the necessary dll required for dif export. Please download the plugin from the proper location: https://github.com/RandomityGuy/io_dif/releases"
+        )
+
+    difbuilderlib.new_difbuilder.restype = ctypes.c_void_p
+    difbuilderlib.dispose_difbuilder.argtypes = [ctypes.c_void_p]
+    difbuilderlib.add_triangle.argtypes = [
+        ctypes.c_void_p,
+        ctypes.POINTER(ctypes.c_float),
+        ctypes.POINTER(ctypes.c_float),
+        ctypes.POINTER(ctypes.c_float),
+        ctypes.POINTER(ctypes.c_float),
+        ctypes.POINTER(ctypes.c_float),
+        ctypes.POINTER(ctypes.c_float),
+        ctypes.POINTER(ctypes.c_float),
+        ctypes.c_char_p,
+    ]
+    difbuilderlib.build.argtypes = [ctypes.c_void_p, ctypes.c_bool, ctypes.c_int32, ctypes.c_float, ctypes.c_float, ctypes.c_float, STATUSFN]
+    difbuilderlib.build.restype = ctypes.c_void_p
+
+    difbuilderlib.dispose_dif.argtypes = [ctypes.c_void_p]
+    difbuilderlib.write_dif.argtypes = [ctypes.c_void_p, ctypes.c_char_p]
+
+    difbuilderlib.add_pathed_interior.argtypes = [
+        ctypes.c_void_p,
+        ctypes.c_void_p,
+        ctypes.c_void_p,
+    ]
+
+    difbuilderlib.new_marker_list.restype = ctypes.c_void_p
+    difbuilderlib.dispose_marker_list.argtypes = [ctypes.c_void_p]
+    difbuilderlib.push_marker.argtypes = [
+        ctypes.c_void_p,
+        ctypes.POINTER(ctypes.c_float),
+        ctypes.c_int,
+        ctypes.c_int,
+    ]
+    difbuilderlib.add_game_entity.argtypes = [
+        ctypes.c_void_p,
+        ctypes.c_char_p,
+        ctypes.c_char_p,
+        ctypes.POINTER(ctypes.c_float),
+        ctypes.c_void_p,
+    ]
+    difbuilderlib.new_dict.restype = ctypes.c_void_p
+    difbuilderlib.dispose_dict.argtypes = [ctypes.c_void_p]
+    difbuilderlib.add_dict_kvp.argtypes = [
+        ctypes.c_void_p,
+        ctypes.c_char_p,
+        ctypes.c_char_p,
+    ]
+    difbuilderlib.add_trigger.argtypes = [
+        ctypes.c_void_p,
+        ctypes.POINTER(ctypes.c_float),
+        ctypes.c_char_p,
+        ctypes.c_char_p,
+        ctypes.c_void_p,
+    ]
+
+    _difbuilderlib = difbuilderlib
+    return _difbuilderlib
 
 current_status = (False, 0, 0, "", "")
 
@@ -100,25 +112,25 @@ obj = bpy.context.active_object
 
 class MarkerList:
     def __init__(self):
-        self.__ptr__ = difbuilderlib.new_marker_list()
+        self.__ptr__ = _lib().new_marker_list()
 
     def __del__(self):
-        difbuilderlib.dispose_marker_list(self.__ptr__)
+        _lib().dispose_marker_list(self.__ptr__)
 
     def push_marker(self, vec, msToNext, initialPathPosition):
         vecarr = (ctypes.c_float * len(vec))(*vec)
-        difbuilderlib.push_marker(self.__ptr__, vecarr, msToNext, initialPathPosition)
+        _lib().push_marker(self.__ptr__, vecarr, msToNext, initialPathPosition)
 
 
 class DIFDict:
     def __init__(self):
-        self.__ptr__ = difbuilderlib.new_dict()
+        self.__ptr__ = _lib().new_dict()
 
     def __del__(self):
-        difbuilderlib.dispose_dict(self.__ptr__)
+        _lib().dispose_dict(self.__ptr__)
 
     def add_kvp(self, key, value):
-        difbuilderlib.add_dict_kvp(
+        _lib().add_dict_kvp(
             self.__ptr__,
             ctypes.create_string_buffer(key.encode("ascii")),
             ctypes.create_string_buffer(value.encode("ascii")),
@@ -130,10 +142,10 @@ class Dif:
         self.__ptr__ = ptr
 
     def __del__(self):
-        difbuilderlib.dispose_dif(self.__ptr__)
+        _lib().dispose_dif(self.__ptr__)
 
     def write_dif(self, path):
-        difbuilderlib.write_dif(
+        _lib().write_dif(
             self.__ptr__, ctypes.create_string_buffer(path.encode("ascii"))
         )
 
@@ -145,7 +157,7 @@ class Dif:
         propertydict.add_kvp("scale", "%.5f %.5f %.5f" % (scale[0], scale[1], scale[2]))
         if gameClass == "Trigger":
             propertydict.add_kvp("polyhedron", "0 0 0 1 0 0 0 -1 0 0 0 1")
-        difbuilderlib.add_game_entity(
+        _lib().add_game_entity(
             self.__ptr__,
             ctypes.create_string_buffer(gameClass.encode("ascii")),
             ctypes.create_string_buffer(datablock.encode("ascii")),
@@ -156,10 +168,10 @@ class Dif:
 
 class DifBuilder:
     def __init__(self):
-        self.__ptr__ = difbuilderlib.new_difbuilder()
+        self.__ptr__ = _lib().new_difbuilder()
 
     def __del__(self):
-        difbuilderlib.dispose_difbuilder(self.__ptr__)
+        _lib().dispose_difbuilder(self.__ptr__)
 
     def add_triangle(self, p1, p2, p3, uv1, uv2, uv3, n, material):
         p1arr = (ctypes.c_float * len(p1))(*p1)
@@ -178,18 +190,18 @@ class DifBuilder:
 
         mat = ctypes.c_char_p(material.encode("ascii"))
 
-        difbuilderlib.add_triangle(
+        _lib().add_triangle(
             self.__ptr__, p3arr, p2arr, p1arr, uv3arr, uv2arr, uv1arr, narr, mat
         )
 
     def add_pathed_interior(self, dif: Dif, markerlist: MarkerList):
-        difbuilderlib.add_pathed_interior(self.__ptr__, dif.__ptr__, markerlist.__ptr__)
+        _lib().add_pathed_interior(self.__ptr__, dif.__ptr__, markerlist.__ptr__)
 
     # NONFUNCTIONAL, TRIGGERS ARENT GETTING CREATED WHEN PRESSING CREATE SUBS
     def add_trigger(self, datablock, name, position, scale, props: DIFDict):
         posarr = (ctypes.c_float * len(position))(*position)
         props.add_kvp("scale", f"{scale[0]} {scale[1]} {scale[2]}")
-        difbuilderlib.add_trigger(
+        _lib().add_trigger(
             self.__ptr__,
             posarr,
             ctypes.create_string_buffer(name.encode("ascii")),
@@ -198,7 +210,7 @@ class DifBuilder:
         )
 
     def build(self, mbonly, bspmode, pointepsilon, planeepsilon, splitepsilon):
-        return Dif(difbuilderlib.build(self.__ptr__, mbonly, bspmode, pointepsilon, planeepsilon, splitepsilon, update_status_c))
+        return Dif(_lib().build(self.__ptr__, mbonly, bspmode, pointepsilon, planeepsilon, splitepsilon, update_status_c))
 
 
 def mesh_triangulate(me):
@@ -234,8 +246,8 @@ def resolve_texture(mat: Material, usematnames: bool):
 
 def get_offset(depsgraph, applymodifiers=True):
     obs = bpy.context.scene.objects
-    minv = [1e9, 1e9, 1e9]
-    maxv = [-1e9, -1e9, -1e9]
+    minv = np.full(3, 1e9, dtype=np.float32)
+    maxv = np.full(3, -1e9, dtype=np.float32)
 
     for obj in obs:
         ob_eval = obj.evaluated_get(depsgraph) if applymodifiers else obj
@@ -244,18 +256,21 @@ def get_offset(depsgraph, applymodifiers=True):
         except RuntimeError:
             continue
 
-        mesh.transform(ob_eval.matrix_world)
+        vert_count = len(mesh.vertices)
+        if vert_count != 0:
+            co = np.empty(vert_count * 3, dtype=np.float32)
+            mesh.vertices.foreach_get("co", co)
 
-        for vert in mesh.vertices:
-            for i in range(0, 3):
-                if minv[i] > vert.co[i]:
-                    minv[i] = vert.co[i]
-                if maxv[i] < vert.co[i]:
-                    maxv[i] = vert.co[i]
+            # Transform the local coordinates here instead of writing them back into the mesh
+            mat = np.array(ob_eval.matrix_world, dtype=np.float32)
+            co = co.reshape(-1, 3) @ mat[:3, :3].T + mat[:3, 3]
+
+            minv = np.minimum(minv, co.min(axis=0))
+            maxv = np.maximum(maxv, co.max(axis=0))
 
         ob_eval.to_mesh_clear()
 
-    off = [((maxv[i] - minv[i]) / 2) + 50 for i in range(0, 3)]
+    off = [float((maxv[i] - minv[i]) / 2) + 50 for i in range(0, 3)]
     return off
 
 
@@ -324,8 +339,14 @@ def build_pathed_interior(ob: Object, marker_ob: Curve, offset, flip, double, us
 
     marker_list = MarkerList()
 
-    for pt in marker_pts:
-        marker_list.push_marker(pt.co, msToNext, initialPathPosition)
+    # Bezier points have 3 component coordinates, NURBS points have 4
+    co_width = len(marker_pts[0].co)
+    co_flat = np.empty(len(marker_pts) * co_width, dtype=np.float32)
+    marker_pts.foreach_get("co", co_flat)
+    co_arr = co_flat.reshape(-1, co_width)[:, :3]
+
+    for co in co_arr:
+        marker_list.push_marker(co, msToNext, initialPathPosition)
 
     ob.to_mesh_clear()
 
@@ -354,6 +375,54 @@ def build_game_entity(ob: Object):
     )
 
 
+def is_object_instance_selected(object_instance):
+    # For instanced objects we check selection of their instancer (more accurately: check
+    # selection status of the original object corresponding to the instancer).
+    if object_instance.parent:
+        return object_instance.parent.original.select_get()
+    # For non-instanced objects we check selection state of the original object.
+    return object_instance.object.original.select_get()
+
+
+def is_object_instance_visible(object_instance):
+    # For instanced objects we check visibility of their instancer (more accurately: check
+    # visibility status of the original object corresponding to the instancer).
+    if object_instance.parent:
+        return object_instance.parent.original.visible_get()
+    # For non-instanced objects we check visibility state of the original object.
+    return object_instance.object.original.visible_get()
+
+
+def _iter_objects(context, depsgraph, exportselected, exportvisible, applymodifiers):
+    # handle normal export for lower versions
+    if bpy.app.version < (3, 1, 0) or not applymodifiers:
+        obs = (
+            context.selected_objects
+            if exportselected
+            else context.scene.objects
+        )
+        for ob in obs:
+            ob: Object = ob
+            if exportvisible:
+                if not ob.visible_get():
+                    continue
+
+            yield ob.evaluated_get(depsgraph) if applymodifiers else ob
+        return
+
+    # handle object instances for these versions
+    for object_instance in depsgraph.object_instances:
+        if exportselected:
+            if not is_object_instance_selected(object_instance):
+                continue
+
+        if exportvisible:
+            if not is_object_instance_visible(object_instance):
+                continue
+
+        yield object_instance.object
+
+
 def save(
     context: bpy.types.Context,
     filepath: str = "",
@@ -370,7 +439,6 @@ def save(
     planeepsilon=1e-5,
     splitepsilon=1e-4
 ):
-    import bpy
     import bmesh
 
     builders = [DifBuilder()]
@@ -449,98 +517,29 @@ def save(
     mp_list = []
     game_entities: list[Object] = []
 
-    def is_object_instance_selected(object_instance):
-        # For instanced objects we check selection of their instancer (more accurately: check
-        # selection status of the original object corresponding to the instancer).
-        if object_instance.parent:
-            return object_instance.parent.original.select_get()
-        # For non-instanced objects we check selection state of the original object.
-        return object_instance.object.original.select_get()
-
-    def is_object_instance_visible(object_instance):
-        # For instanced objects we check visibility of their instancer (more accurately: check
-        # visibility status of the original object corresponding to the instancer).
-        if object_instance.parent:
-            return object_instance.parent.original.visible_get()
-        # For non-instanced objects we check visibility state of the original object.
-        return object_instance.object.original.visible_get()
+    for ob_eval in _iter_objects(context, depsgraph, exportselected, exportvisible, applymodifiers):
+        dif_props = ob_eval.dif_props
 
-    # handle normal export for lower versions
-    if bpy.app.version < (3, 1, 0) or not applymodifiers:
-        obs = (
-            bpy.context.selected_objects
-            if exportselected
-            else bpy.context.scene.objects
-        )
-        for ob in obs:
-            ob: Object = ob
-            if exportvisible:
-                if not ob.visible_get():
-                    continue
-
-            ob_eval = ob.evaluated_get(depsgraph) if applymodifiers else ob
-
-            dif_props = ob_eval.dif_props
-
-            if dif_props.interior_type == "game_entity":
-                game_entities.append(ob_eval)
-
-            try:
-                me = ob_eval.to_mesh()
-            except RuntimeError:
-                continue
-
-            if dif_props.interior_type == "static_interior":
-                me.transform(ob_eval.matrix_world)
-                try:
-                    save_mesh(ob_eval, me, off, flip, double)
-                except:
-                    print("Skipping mesh due to issue while saving")
-
-            ob_eval.to_mesh_clear()
+        if dif_props.interior_type == "game_entity":
+            game_entities.append(ob_eval)
 
-            if dif_props.interior_type == "pathed_interior":
-                mp_list.append((ob_eval, dif_props.marker_path))
-
-    # handle object instances for these versions, ew code duplication
-    if bpy.app.version >= (3, 1, 0) and applymodifiers:
-        for object_instance in depsgraph.object_instances:
-            if exportselected:
-                if not is_object_instance_selected(object_instance):
-                    continue
-
-            if exportvisible:
-                if not is_object_instance_visible(object_instance):
-                    continue
-
-            ob_eval = (
-                object_instance.object
-                if applymodifiers
-                else object_instance.object.original
-            )
-
-            dif_props = ob_eval.dif_props
-
-            if dif_props.interior_type == "game_entity":
-                game_entities.append(ob_eval)
+        try:
+            me = ob_eval.to_mesh()
+        except RuntimeError:
+            print("Skipping mesh due to bad eval")
+            continue
 
+        if dif_props.interior_type == "static_interior":
+            me.transform(ob_eval.matrix_world)
             try:
-                me = ob_eval.to_mesh()
-            except RuntimeError:
-                print("Skipping mesh due to bad eval")
-                continue
-
-            if dif_props.interior_type == "static_interior":
-                me.transform(ob_eval.matrix_world)
-                try:
-                    save_mesh(ob_eval, me, off, flip, double)
-                except:
-                    print("Skipping mesh due to issue while saving")
+                save_mesh(ob_eval, me, off, flip, double)
+            except:
+                print("Skipping mesh due to issue while saving")
 
-            ob_eval.to_mesh_clear()
+        ob_eval.to_mesh_clear()
 
-            if dif_props.interior_type == "pathed_interior":
-                mp_list.append((ob_eval, dif_props.marker_path))
+        if dif_props.interior_type == "pathed_interior":
+            mp_list.append((ob_eval, dif_props.marker_path))
 
     mp_difs = []
 
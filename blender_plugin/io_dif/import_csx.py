@@ -4,14 +4,23 @@ import bpy
 from bpy.props import CollectionProperty
 from bpy.types import Curve, Object
 import mathutils
+import numpy as np
 from bpy_extras.io_utils import unpack_list
 from bpy_extras.image_utils import load_image
 
-from .util import default_materials, resolve_texture, get_rgb_colors
+from .util import (
+    default_materials,
+    get_rgb_colors,
+    aabb,
+    fill_mesh,
+    material_cache,
+    clear_import_caches,
+    new_textured_material,
+)
 
 from bpy_extras.wm_utils.progress_report import ProgressReport, ProgressReportSubstep
 
-import xml.etree.ElementTree as ET
+from xml.parsers import expat
 
 
 class CSXEntity:
@@ -19,7 +28,7 @@ class CSXEntity:
         self,
         id: str,
         className: str,
-        origin: list[float],
+        origin: np.ndarray,
         properties: dict,
     ):
         self.id = id
@@ -31,25 +40,23 @@ class CSXEntity:
 class CSXTexGen:
     def __init__(
         self,
-        planeX: list[float],
-        planeY: list[float],
+        planeX: np.ndarray,
+        planeY: np.ndarray,
         texRot: float,
-        texScale: list[float],
+        texScale: np.ndarray,
     ):
         self.texRot = texRot
         self.texScale = texScale
         self.texPlaneX = planeX
         self.texPlaneY = planeY
+        self.axes = None
 
-    def compute_uv(self, vertex: list[float], texsizes: list[float]):
-        if self.texScale[0] * self.texScale[1] == 0:
-            return [0, 0]
-        axisU, axisV = self.transform_axes()
-        target = self.project_raw(vertex, axisU, axisV)
-        target[0] *= (1 / self.texScale[0]) * (32 / texsizes[0])
-        target[1] *= (1 / -self.texScale[1]) * (32 / texsizes[1])
-
-        shift = [self.texPlaneX[3] / texsizes[0], -self.texPlaneY[3] / texsizes[1]]
+    def uv_transform(self, texsizes: list[float]):
+        scale = (
+            (1 / self.texScale[0]) * (32 / texsizes[0]),
+            (1 / -self.texScale[1]) * (32 / texsizes[1]),
+        )
+        shift = (self.texPlaneX[3] / texsizes[0], -self.texPlaneY[3] / texsizes[1])
 
         # rotate shift
         # if self.texRot % 360 != 0:
@@ -60,41 +67,59 @@ class CSXTexGen:
         #         + shift[1] * math.cos(math.radians(self.texRot)),
         #     )
 
-        target[0] += shift[0]
-        target[1] += shift[1]
-        return target
-
-    def project_raw(self, vertex: list[float], axisU: list[float], axisV: list[float]):
-        return [
-            vertex[0] * axisU[0] + vertex[1] * axisU[1] + vertex[2] * axisU[2],
-            vertex[0] * axisV[0] + vertex[1] * axisV[1] + vertex[2] * axisV[2],
-        ]
+        return scale, shift
 
     def transform_axes(self):
-        axisU = mathutils.Vector(
-            (self.texPlaneX[0], self.texPlaneX[1], self.texPlaneX[2])
-        )
-        axisV = mathutils.Vector(
-            (self.texPlaneY[0], self.texPlaneY[1], self.texPlaneY[2])
-        )
-        if self.texRot % 360 == 0:
-            return axisU, axisV
-        upDir = axisU.cross(axisV)
-        rotMat = mathutils.Matrix.Rotation(math.radians(self.texRot), 3, upDir)
-        axisU.rotate(rotMat)
-        axisV.rotate(rotMat)
-        return axisU, axisV
+        # The axes only depend on the texgen, so compute them once per face
+        if self.axes is not None:
+            return self.axes
+        axisU = (float(self.texPlaneX[0]), float(self.texPlaneX[1]), float(self.texPlaneX[2]))
+        axisV = (float(self.texPlaneY[0]), float(self.texPlaneY[1]), float(self.texPlaneY[2]))
+        if self.texRot % 360 != 0:
+            upDir = cross(axisU, axisV)
+            length = math.sqrt(dot(upDir, upDir))
+            if length != 0:
+                upDir = (upDir[0] / length, upDir[1] / length, upDir[2] / length)
+                angle = math.radians(self.texRot)
+                cos, sin = math.cos(angle), math.sin(angle)
+                axisU = rotate_axis_angle(axisU, upDir, cos, sin)
+                axisV = rotate_axis_angle(axisV, upDir, cos, sin)
+        self.axes = (axisU, axisV)
+        return self.axes
+
+
+def dot(a, b):
+    return a[0] * b[0] + a[1] * b[1] + a[2] * b[2]
+
+
+def cross(a, b):
+    return (
+        a[1] * b[2] - a[2] * b[1],
+        a[2] * b[0] - a[0] * b[2],
+        a[0] * b[1] - a[1] * b[0],
+    )
+
+
+def rotate_axis_angle(v, axis, cos, sin):
+    # Rodrigues' rotation formula, axis must be normalized
+    kxv = cross(axis, v)
+    kdv = dot(axis, v) * (1 - cos)
+    return (
+        v[0] * cos + kxv[0] * sin + axis[0] * kdv,
+        v[1] * cos + kxv[1] * sin + axis[1] * kdv,
+        v[2] * cos + kxv[2] * sin + axis[2] * kdv,
+    )
 
 
 class CSXBrushFace:
     def __init__(
         self,
         id: str,
-        plane: list[float],
+        plane: np.ndarray,
         material: str,
         texgen: CSXTexGen,
-        indices: list[int],
-        texSize: list[int],
+        indices: np.ndarray,
+        texSize: np.ndarray,
     ):
         self.id = id
         self.plane = plane
@@ -110,10 +135,10 @@ class CSXBrush:
         id: str,
         owner: str,
         type: int,
-        pos: list[float],
-        rot: list[float],
-        transform: list[float],
-        vertices: list[list[float]],
+        pos: np.ndarray,
+        rot: np.ndarray,
+        transform: np.ndarray,
+        vertices: np.ndarray,
         faces: list[CSXBrushFace],
     ):
         self.id = id
@@ -121,8 +146,8 @@ class CSXBrush:
         self.type = type
         self.pos = pos
         self.rot = rot
-        self.transform = transform
-        self.vertices = vertices
+        self.transform = transform  # 4x4
+        self.vertices = vertices  # (N, 3) float32
         self.faces = faces
 
 
@@ -138,108 +163,144 @@ class CSX:
 
 
 def parse_texgen(texgen: str):
-    texgen = texgen.split(" ")
-    planeX = [float(x) for x in texgen[0:4]]
-    planeY = [float(x) for x in texgen[4:8]]
-    texRot = float(texgen[8])
-    texScale = [float(x) for x in texgen[9:]]
-    return CSXTexGen(planeX, planeY, texRot, texScale)
+    # planeX (4), planeY (4), texRot, texScale (2), all views into one buffer
+    values = parse_floats(texgen)
+    return CSXTexGen(values[0:4], values[4:8], float(values[8]), values[9:11])
+
+
+def parse_floats(text: str) -> np.ndarray:
+    return np.fromstring(text, sep=" ", dtype=np.float32)
+
+
+def parse_ints(text: str) -> np.ndarray:
+    return np.fromstring(text, sep=" ", dtype=np.int32)
+
+
+def parse_face(face: dict, indices) -> CSXBrushFace:
+    return CSXBrushFace(
+        face.get("id"),
+        parse_floats(face.get("plane")),
+        face.get("material"),
+        parse_texgen(face.get("texgens")),
+        indices,
+        parse_ints(face.get("texDiv")),
+    )
+
+
+def parse_brush(brush: dict, vertexpositions, faces) -> CSXBrush:
+    return CSXBrush(
+        brush.get("id"),
+        brush.get("owner"),
+        int(brush.get("type")),
+        parse_floats(brush.get("pos")),
+        parse_floats(brush.get("rot")),
+        parse_floats(brush.get("transform")).reshape(4, 4),
+        parse_floats(" ".join(vertexpositions)).reshape(-1, 3),
+        faces,
+    )
+
+
+def parse_entity(entity: dict, properties: dict) -> CSXEntity:
+    if entity.get("isPointEntity") == "0":
+        return None
+    return CSXEntity(
+        entity.get("id"),
+        entity.get("classname"),
+        parse_floats(entity.get("origin")),
+        properties,
+    )
+
+
+class CSXReader:
+    """
+    expat handlers building the scene as elements open and close, everything we need
+    is in attributes so no element tree is ever built
+    """
+
+    def __init__(self):
+        self.details = []
+        self.detailbrushes = []
+        self.detailentities = []
+        self.brush = None
+        self.brushverts = []
+        self.brushfaces = []
+        self.face = None
+        self.faceindices = None
+        self.entity = None
+        self.entityprops = {}
+        # The InteriorMap container ("Brushes" or "Entities") we are currently inside of
+        self.container = None
+
+    def start(self, tag, attrs):
+        container = self.container
+        if tag == "Brushes" or tag == "Entities":
+            self.container = tag
+        elif container == "Brushes":
+            if tag == "Vertex":
+                self.brushverts.append(attrs["pos"])
+            elif tag == "Face":
+                self.face = attrs
+            elif tag == "Indices":
+                self.faceindices = parse_ints(attrs["indices"])
+            elif tag == "Brush":
+                self.brush = attrs
+        elif container == "Entities":
+            if tag == "Entity":
+                self.entity = attrs
+                self.entityprops = {}
+            elif tag == "Properties":
+                self.entityprops = attrs
+
+    def end(self, tag):
+        container = self.container
+        if container == "Brushes":
+            if tag == "Face":
+                self.brushfaces.append(parse_face(self.face, self.faceindices))
+                self.faceindices = None
+            elif tag == "Brush":
+                self.detailbrushes.append(parse_brush(self.brush, self.brushverts, self.brushfaces))
+                self.brushverts = []
+                self.brushfaces = []
+            elif tag == "Brushes":
+                self.container = None
+        elif container == "Entities":
+            if tag == "Entity":
+                entity = parse_entity(self.entity, self.entityprops)
+                if entity is not None:
+                    self.detailentities.append(entity)
+            elif tag == "Entities":
+                self.container = None
+        elif tag == "DetailLevel":
+            self.details.append(CSXDetail(self.detailbrushes, self.detailentities))
+            self.detailbrushes = []
+            self.detailentities = []
 
 
 def parse_csx(path):
-    csx: ET.ElementTree = ET.parse(path)
-    csscene = csx.getroot()
-    detailsxml = csscene.find("DetailLevels")
-
-    details = []
-    for detail in detailsxml.iter("DetailLevel"):
-        detailbrushes = []
-        for brush in detail.find("InteriorMap").find("Brushes").iter("Brush"):
-            brushverts = []
-            for vert in brush.find("Vertices").iter("Vertex"):
-                vertdata = [float(x) for x in vert.get("pos").split(" ")]
-                brushverts.append(vertdata)
-            brushfaces = []
-            for face in brush.iter("Face"):
-                brushfaces.append(
-                    CSXBrushFace(
-                        face.get("id"),
-                        [float(x) for x in face.get("plane").split(" ")],
-                        face.get("material"),
-                        parse_texgen(face.get("texgens")),
-                        [
-                            int(x)
-                            for x in face.find("Indices")
-                            .get("indices")
-                            .strip()
-                            .split(" ")
-                        ],
-                        [int(x) for x in face.get("texDiv").split(" ")],
-                    )
-                )
-            detailbrushes.append(
-                CSXBrush(
-                    brush.get("id"),
-                    brush.get("owner"),
-                    int(brush.get("type")),
-                    [float(x) for x in brush.get("pos").split(" ")],
-                    [float(x) for x in brush.get("rot").split(" ")],
-                    [float(x) for x in brush.get("transform").split(" ")],
-                    brushverts,
-                    brushfaces,
-                )
-            )
-
-        detailentities = []
-        for entity in detail.find("InteriorMap").find("Entities").iter("Entity"):
-            if entity.get("isPointEntity") == "0":
-                continue
-            entityprops = entity.find("Properties").attrib
-            detailentities.append(
-                CSXEntity(
-                    entity.get("id"),
-                    entity.get("classname"),
-                    [float(x) for x in entity.get("origin").split(" ")],
-                    entityprops,
-                )
-            )
-
-        details.append(CSXDetail(detailbrushes, detailentities))
-
-    cscene = CSX(details)
+    reader = CSXReader()
+    parser = expat.ParserCreate()
+    parser.StartElementHandler = reader.start
+    parser.EndElementHandler = reader.end
+
+    with open(path, "rb") as f:
+        parser.ParseFile(f)
+
+    cscene = CSX(reader.details)
     return cscene
 
 
 def create_material(filepath, matname):
     if "/" in matname:
         matname = matname.split("/")[1]
-    prevmat = bpy.data.materials.find(matname)
-    if prevmat != -1:
-        return bpy.data.materials.get(matname)
-    mat = bpy.data.materials.new(matname)
-    mat.use_nodes = True
-
-    texname = resolve_texture(filepath, matname)
-    if texname is not None:
-        try:
-            teximg = bpy.data.images.load(texname)
-        except:
-            teximg = None
-            print("Cannot load image", texname)
-
-        texslot = mat.node_tree.nodes.new("ShaderNodeTexImage")
-        texslot.name = matname
-        texslot.image = teximg
-        if bpy.app.version < (4, 0, 0):
-            mat.node_tree.nodes["Principled BSDF"].inputs["Specular"].default_value = 0
-        else:
-            mat.node_tree.nodes["Principled BSDF"].inputs["Roughness"].default_value = 1.0
-        mat.node_tree.links.new(
-            mat.node_tree.nodes["Principled BSDF"].inputs["Base Color"],
-            texslot.outputs["Color"],
-        )
-
-    return mat
+    mat = material_cache.get(matname)
+    if mat is not None:
+        return mat
+    # Reuse materials that are already in the blend file
+    mat = bpy.data.materials.get(matname)
+    if mat is not None:
+        material_cache[matname] = mat
+        return mat
+    return new_textured_material(filepath, matname)
 
 
 # texsize: scale: factor
@@ -249,126 +310,82 @@ def create_material(filepath, matname):
 # 16     : 1    :  16
 
 
-def create_mesh(filepath, brush: CSXBrush):
+def compute_loop_uvs(faces: list[CSXBrushFace], points: np.ndarray, face_lens: np.ndarray) -> np.ndarray:
+    """
+    UVs of every loop of a brush in one pass, points is the (L, 3) array of loop positions.
+    Only the per face axes/scale/shift are gathered in Python, the projection itself is
+    done for all loops at once so small faces don't each pay for their own NumPy calls.
+    """
+    axes = np.empty((len(faces), 2, 3), dtype=np.float32)
+    scales = np.zeros((len(faces), 2), dtype=np.float32)
+    shifts = np.zeros((len(faces), 2), dtype=np.float32)
+    for (i, face) in enumerate(faces):
+        texgen = face.texgen
+        axes[i] = texgen.transform_axes()
+        # Faces with a zero texture scale keep all-zero UVs
+        if texgen.texScale[0] * texgen.texScale[1] != 0:
+            scales[i], shifts[i] = texgen.uv_transform(face.texSize)
+
+    loop_faces = np.repeat(np.arange(len(faces)), face_lens)
+    uvs = np.einsum("lj,lkj->lk", points, axes[loop_faces])
+    uvs *= scales[loop_faces]
+    uvs += shifts[loop_faces]
+    return uvs
+
+
+def create_mesh(filepath, brush: CSXBrush, validate_mesh=True):
     """
     :param Interior interior:
+    :param bool validate_mesh: run me.validate() on the result, see fill_mesh
     :return:
     """
     me = bpy.data.meshes.new("Mesh")
 
-    materials = list(set(x.material for x in brush.faces))
+    materials = list(dict.fromkeys(x.material for x in brush.faces))
+    mat_index = {mat: i for i, mat in enumerate(materials)}
 
     for mat in materials:
         me.materials.append(create_material(filepath, mat))
 
-    if bpy.app.version < (4, 0, 0):
-        me.vertices.add(len(brush.vertices))
-        for i in range(0, len(brush.vertices)):
-            me.vertices[i].co = brush.vertices[i]
-
-        me.polygons.add(len(brush.faces))
-        tot_loops = 0
-        for face in brush.faces:
-            tot_loops += len(face.indices)
-
-        me.loops.add(tot_loops)
-
-        surface_uvs = {}
-        cur_loop_idx = 0
-
-        for (i, face) in enumerate(brush.faces):
-            tex_gen = face.texgen
-
-            normal = face.plane[:3]
-
-            polygon = me.polygons[i]
-            polygon.loop_start = cur_loop_idx
-            polygon.loop_total = len(face.indices)
-            cur_loop_idx += polygon.loop_total
-            polygon.material_index = materials.index(face.material)
-
-            for j, index in enumerate(face.indices):
-                me.loops[j + polygon.loop_start].vertex_index = index
-                me.loops[j + polygon.loop_start].normal = normal
+    faces = brush.faces
+    verts_np = brush.vertices
 
-                pt = brush.vertices[index]
+    face_lens = np.fromiter((len(face.indices) for face in faces), dtype=np.int32, count=len(faces))
+    loop_starts = np.zeros(len(faces), dtype=np.int32)
+    np.cumsum(face_lens[:-1], out=loop_starts[1:])
 
-                uv = tex_gen.compute_uv(pt, face.texSize)
-                surface_uvs[j + polygon.loop_start] = uv
+    material_indices = np.fromiter(
+        (mat_index[face.material] for face in faces), dtype=np.int32, count=len(faces)
+    )
+    if faces:
+        vertex_indices = np.concatenate([face.indices for face in faces]).astype(np.int32, copy=False)
+    else:
+        vertex_indices = np.empty(0, dtype=np.int32)
+    surface_uvs = compute_loop_uvs(faces, verts_np[vertex_indices], face_lens)
 
-        me.uv_layers.new()
-        uvs = me.uv_layers[0]
+    fill_mesh(me, verts_np, vertex_indices, loop_starts, face_lens, material_indices, surface_uvs)
 
-        for loop_idx in surface_uvs:
-            uvs.data[loop_idx].uv = surface_uvs[loop_idx]
-    else:
-        verts = []
-        faces = []
-        face_texs = []
-        face_uvs = []
-        for vert in brush.vertices:
-            verts.append(vert)
-
-        for face in brush.faces:
-            face_verts = []
-            for index in face.indices:
-                face_verts.append(index)
-            faces.append(face_verts)
-            face_texs.append(face.material)
-            uvs = []
-            for i in range(0, len(face.indices)):
-                uvs.append(face.texgen.compute_uv(verts[face.indices[i]], face.texSize))
-            face_uvs.append(uvs)
-
-        me.from_pydata(verts, [], faces)
-
-        if not me.uv_layers:
-            me.uv_layers.new()
-
-        uv_layer = me.uv_layers.active.data
-
-        for i, poly in enumerate(me.polygons):
-            p: bpy.types.MeshPolygon = poly
-            p.material_index = materials.index(face_texs[i])
-            
-            for j, loop_index in enumerate(p.loop_indices):
-                loop = me.loops[loop_index]
-                uv_layer[loop.index].uv = face_uvs[i][j]
-
-    me.validate()
+    if validate_mesh:
+        me.validate()
     me.update()
 
-    transformmat = mathutils.Matrix(
-        [[brush.transform[4 * i + j] for j in range(0, 4)] for i in range(0, 4)]
-    )
+    transformmat = mathutils.Matrix(brush.transform)
 
     _, rotq, scale = transformmat.decompose()
-    rot: mathutils.Quaternion = rotq
-
-    newmat = mathutils.Matrix(
-        ((scale.x, 0, 0, 0), (0, scale.y, 0, 0), (0, 0, scale.z, 0), (0, 0, 0, 1))
-    )
-    tmp = mathutils.Matrix.Rotation(
-        rot.angle, 4, mathutils.Vector((rot.axis.x, rot.axis.y, rot.axis.z))
-    )
 
-    newmat = newmat @ tmp
-
-    newmat[0][3] = transformmat[0][3]
-    newmat[1][3] = transformmat[1][3]
-    newmat[2][3] = transformmat[2][3]
+    # scale @ rotation, built straight from the quaternion instead of going through axis/angle
+    newmat = (mathutils.Matrix.Diagonal(scale) @ rotq.to_matrix()).to_4x4()
+    newmat.translation = transformmat.translation
 
     ob = bpy.data.objects.new("Object", me)
     ob.empty_display_type = "SINGLE_ARROW"
     ob.empty_display_size = 0.5
-    # ob.matrix_world = [
-    #     [brush.transform[4 * i + j] for j in range(0, 4)] for i in range(0, 4)
-    # ]
+    # ob.matrix_world = brush.transform
     ob.matrix_world = newmat
     # ob.rotation_axis_angle = (rot.axis.x, rot.axis.y, rot.axis.z, rot.angle)
     # ob.rotation_mode = "AXIS_ANGLE"
     # ob.scale = (scale.x, scale.y, scale.z)
-    # ob.location = [brush.transform[3], brush.transform[7], brush.transform[11]]
+    # ob.location = brush.transform[:3, 3]
 
     return ob
 
@@ -386,7 +403,8 @@ def load(
     use_groups_as_vgroups=False,
     use_cycles=True,
     relpath=None,
-    global_matrix=None
+    global_matrix=None,
+    validate_meshes=True
 ):
     """
     Called by the user interface or another script.
@@ -395,64 +413,59 @@ def load(
         to be split into objects and then converted into mesh objects
     """
 
+    clear_import_caches()
+
     csscene = parse_csx(str(filepath))
 
     if global_matrix is None:
         global_matrix = mathutils.Matrix()
 
-    # deselect all
-    if bpy.ops.object.select_all.poll():
-        bpy.ops.object.select_all(action="DESELECT")
+    # deselect all, copied since deselecting changes the collection we iterate
+    for ob in list(context.view_layer.objects.selected):
+        ob.select_set(False)
 
     scene = context.scene
     new_objects: list[Object] = []  # put new objects here
+    entity_objects: list[Object] = []
 
     for detail in csscene.details:
         for brush in detail.brushes:
-            new_objects.append(create_mesh(filepath, brush))
+            new_objects.append(create_mesh(filepath, brush, validate_meshes))
 
         for ge in detail.entities:
             g: CSXEntity = ge
             gobj = bpy.data.objects.new(g.className, None)
             gobj.location = g.origin
-            gobj.dif_props.interior_type = "game_entity"
-            gobj.dif_props.game_entity_datablock = g.className
-            gobj.dif_props.game_entity_gameclass = g.properties["game_class"]
-            for key in g.properties:
-                prop = gobj.dif_props.game_entity_properties.add()
+            dif_props = gobj.dif_props
+            dif_props.interior_type = "game_entity"
+            dif_props.game_entity_datablock = g.className
+            dif_props.game_entity_gameclass = g.properties["game_class"]
+            add_prop = dif_props.game_entity_properties.add
+            for key, value in g.properties.items():
+                prop = add_prop()
                 prop.key = key
-                prop.value = g.properties.get(key)
-            scene.collection.objects.link(gobj)
+                prop.value = value
+            entity_objects.append(gobj)
 
-    # Create new obj
+    # Link everything in one pass, once all the objects are fully set up
+    link = scene.collection.objects.link
     for obj in new_objects:
-        base = scene.collection.objects.link(obj)
+        link(obj)
+    for obj in entity_objects:
+        link(obj)
 
     context.view_layer.update()
 
-    axis_min = [1000000000] * 3
-    axis_max = [-1000000000] * 3
-
-    if global_clamp_size:
+    if global_clamp_size and new_objects:
         # Get all object bounds
-        for ob in new_objects:
-            for v in ob.bound_box:
-                for axis, value in enumerate(v):
-                    if axis_min[axis] > value:
-                        axis_min[axis] = value
-                    if axis_max[axis] < value:
-                        axis_max[axis] = value
+        axis_min, axis_max = aabb([ob.bound_box for ob in new_objects])
 
         # Scale objects
-        max_axis = max(
-            axis_max[0] - axis_min[0],
-            axis_max[1] - axis_min[1],
-            axis_max[2] - axis_min[2],
-        )
-        scale = 1.0
-
-        while global_clamp_size < max_axis * scale:
-            scale = scale / 10.0
+        max_axis = float((axis_max - axis_min).max())
+        if max_axis > global_clamp_size:
+            scale = 10.0 ** -math.ceil(math.log10(max_axis / global_clamp_size))
+        else:
+            scale = 1.0
 
         for obj in new_objects:
             obj.scale = scale, scale, scale
@@ -1,14 +1,25 @@
 import array
 import os
 import time
+from collections import namedtuple
+from operator import attrgetter
 import bpy
 from bpy.props import CollectionProperty
 from bpy.types import Curve, Object
 import mathutils
+import numpy as np
 from .hxDif import *
 from bpy_extras.io_utils import unpack_list
 from bpy_extras.image_utils import load_image
-from .util import default_materials, resolve_texture, get_rgb_colors
+from .util import (
+    default_materials,
+    get_rgb_colors,
+    aabb,
+    fill_mesh,
+    material_cache,
+    clear_import_caches,
+    new_textured_material,
+)
 
 from bpy_extras.wm_utils.progress_report import ProgressReport, ProgressReportSubstep
 
@@ -16,183 +27,128 @@ from bpy_extras.wm_utils.progress_report import ProgressReport, ProgressReportSu
 def create_material(filepath, matname):
     if "/" in matname:
         matname = matname.split("/")[1]
-    mat = bpy.data.materials.new(matname)
-    mat.use_nodes = True
-
-    texname = resolve_texture(filepath, matname)
-    if texname is not None:
-        try:
-            teximg = bpy.data.images.load(texname)
-        except:
-            teximg = None
-            print("Cannot load image", texname)
-
-        texslot = mat.node_tree.nodes.new("ShaderNodeTexImage")
-        texslot.name = matname
-        texslot.image = teximg
-        if bpy.app.version < (4, 0, 0):
-            mat.node_tree.nodes["Principled BSDF"].inputs["Specular"].default_value = 0
-        else:
-            mat.node_tree.nodes["Principled BSDF"].inputs["Roughness"].default_value = 1.0
-        mat.node_tree.links.new(
-            mat.node_tree.nodes["Principled BSDF"].inputs["Base Color"],
-            texslot.outputs["Color"],
-        )
-
-    return mat
+    mat = material_cache.get(matname)
+    if mat is not None:
+        return mat
+    return new_textured_material(filepath, matname)
 
 
 def fix_indices(indices: list[int]):
-    new_indices = [0] * len(indices)
-    for i in range(len(indices)):
-        if i >= 2:
-            if i % 2 == 0:
-                new_indices[len(indices) - 1 - (i - 2) // 2] = indices[i]
-            else:
-                new_indices[(i + 1) // 2] = indices[i]
-        else:
-            new_indices[i] = indices[i]
-    return new_indices
-
-
-def create_mesh(filepath, interior: Interior):
-    """
-    :param Interior interior:
-    :return:
-    """
-    me = bpy.data.meshes.new("Mesh")
-
-    for mat in interior.materialList:
-        me.materials.append(create_material(filepath, mat))
-
-    surfaces: list[Surface] = interior.surfaces
-
-    if bpy.app.version < (4, 0, 0):
-        me.vertices.add(len(interior.points))
-        for i in range(0, len(interior.points)):
-            me.vertices[i].co = [
-                interior.points[i].x,
-                interior.points[i].y,
-                interior.points[i].z,
-            ]
-
-        me.polygons.add(len(surfaces))
-
-        loop_count = 0
-        for surf in surfaces:
-            loop_count += surf.windingCount
-
-        me.loops.add(loop_count)
-
-        surface_uvs = {}
-        cur_loop_idx = 0
-
-        for (i, surface) in enumerate(surfaces):
-            surf_indices = interior.windings[
-                surface.windingStart : (surface.windingStart + surface.windingCount)
-            ]
-
-            surf_indices = fix_indices(surf_indices)
-
-            plane_flipped = surface.planeFlipped
-            normal_index = interior.planes[surface.planeIndex & ~0x8000].normalIndex
-            tex_gen = interior.texGenEQs[surface.texGenIndex]
-
-            normal = interior.normals[normal_index]
-            if plane_flipped:
-                normal.x *= -1
-                normal.y *= -1
-                normal.z *= -1
-
-            polygon = me.polygons[i]
-            polygon.loop_start = cur_loop_idx
-            polygon.loop_total = len(surf_indices)
-            cur_loop_idx += polygon.loop_total
-            polygon.material_index = surface.textureIndex
-
-            def plane_to_uv(pt, plane):
-                return pt.x * plane.x + pt.y * plane.y + pt.z * plane.z + plane.d
-
-            for j, index in enumerate(surf_indices):
-                me.loops[j + polygon.loop_start].vertex_index = index
-                me.loops[j + polygon.loop_start].normal = (normal.x, normal.y, normal.z)
+    # Reorders a triangle strip winding into a polygon: after the first two, the odd
+    # entries continue the head in order and the even entries make up the tail reversed
+    return indices[:2] + indices[3::2] + indices[2::2][::-1]
 
-                pt = interior.points[index]
 
-                uv = (
-                    plane_to_uv(pt, tex_gen.planeX),
-                    -plane_to_uv(pt, tex_gen.planeY),
-                )
-                surface_uvs[j + polygon.loop_start] = uv
+# fix_indices only depends on the winding length, so keep its permutation per length
+_winding_perms: dict[int, np.ndarray] = {}
 
-        me.uv_layers.new()
-        uvs = me.uv_layers[0]
 
-        for loop_idx in surface_uvs:
-            uvs.data[loop_idx].uv = surface_uvs[loop_idx]
-    else:
-        mesh_verts = []
-        for i in range(0, len(interior.points)):
-            mesh_verts.append((interior.points[i].x, interior.points[i].y, interior.points[i].z))
+def winding_permutation(count: int):
+    perm = _winding_perms.get(count)
+    if perm is None:
+        perm = np.array(fix_indices(list(range(count))), dtype=np.int32)
+        _winding_perms[count] = perm
+    return perm
 
-        mesh_faces = []
-        face_texs = []
-        face_uvs = []
-        cur_loop_idx = 0
 
-        for (i, surface) in enumerate(surfaces):
-            surf_indices = interior.windings[
-                surface.windingStart : (surface.windingStart + surface.windingCount)
-            ]
-
-            surf_indices = fix_indices(surf_indices)
-
-            plane_flipped = surface.planeFlipped
-            normal_index = interior.planes[surface.planeIndex & ~0x8000].normalIndex
-            tex_gen = interior.texGenEQs[surface.texGenIndex]
-
-            normal = interior.normals[normal_index]
-            if plane_flipped:
-                normal.x *= -1
-                normal.y *= -1
-                normal.z *= -1
-
-            polygon = surf_indices
-            cur_loop_idx += len(surf_indices)
-            mesh_faces.append(polygon)
+def texgen_planes(texgens: list[TexGenEQ]) -> np.ndarray:
+    """
+    Texgen planes as a (T, 2, 4) array of (x, y, z, d) rows, the V plane is negated
+    so that a UV is just the point dotted with each row plus d
+    """
+    planes = np.empty((len(texgens), 2, 4), dtype=np.float32)
+    for (i, tex_gen) in enumerate(texgens):
+        planeX = tex_gen.planeX
+        planeY = tex_gen.planeY
+        planes[i, 0] = (planeX.x, planeX.y, planeX.z, planeX.d)
+        planes[i, 1] = (-planeY.x, -planeY.y, -planeY.z, -planeY.d)
+    return planes
 
-            face_texs.append(surface.textureIndex)
 
-            def plane_to_uv(pt, plane):
-                return pt.x * plane.x + pt.y * plane.y + pt.z * plane.z + plane.d
-
-            face_uv = []
-            for j, index in enumerate(surf_indices):
-                pt = interior.points[index]
-
-                uv = (
-                    plane_to_uv(pt, tex_gen.planeX),
-                    -plane_to_uv(pt, tex_gen.planeY),
-                )
-                face_uv.append(uv)
-            face_uvs.append(face_uv)
+def loop_uvs(loop_pts: np.ndarray, loop_planes: np.ndarray) -> np.ndarray:
+    """
+    Texture coordinates of an (L, 3) array of loop points, given the (L, 2, 4) texgen
+    planes of each loop, returns an (L, 2) array
+    """
+    return np.einsum("lj,lkj->lk", loop_pts, loop_planes[:, :, :3]) + loop_planes[:, :, 3]
+
+
+# Everything create_mesh reads from an Interior, copied out of the hxDif objects once
+InteriorArrays = namedtuple(
+    "InteriorArrays",
+    [
+        "points",  # (N, 3) float32
+        "windings",  # (W,) int32
+        "winding_starts",  # per surface, int32
+        "winding_counts",
+        "texture_indices",
+        "texgen_indices",
+        "texgen_planes",  # (T, 2, 4) float32, see texgen_planes
+    ],
+)
+
+
+def surface_field(surfaces: list[Surface], name: str) -> np.ndarray:
+    return np.fromiter(map(attrgetter(name), surfaces), dtype=np.int32, count=len(surfaces))
+
+
+def interior_arrays(interior: Interior) -> InteriorArrays:
+    surfaces = interior.surfaces
+    points = interior.points
+    return InteriorArrays(
+        np.fromiter(
+            (c for p in points for c in (p.x, p.y, p.z)), dtype=np.float32, count=3 * len(points)
+        ).reshape(-1, 3),
+        np.fromiter(interior.windings, dtype=np.int32, count=len(interior.windings)),
+        surface_field(surfaces, "windingStart"),
+        surface_field(surfaces, "windingCount"),
+        surface_field(surfaces, "textureIndex"),
+        surface_field(surfaces, "texGenIndex"),
+        texgen_planes(interior.texGenEQs),
+    )
+
+
+def create_mesh(filepath, interior: Interior, validate_mesh=False):
+    """
+    :param Interior interior:
+    :param bool validate_mesh: run me.validate() on the result, see fill_mesh
+    :return:
+    """
+    me = bpy.data.meshes.new("Mesh")
 
-        me.from_pydata(mesh_verts, [], mesh_faces)
+    for mat in interior.materialList:
+        me.materials.append(create_material(filepath, mat))
 
-        if not me.uv_layers:
-            me.uv_layers.new()
+    arrays = interior_arrays(interior)
+    pts = arrays.points
+    winding_counts = arrays.winding_counts
+
+    loop_starts = np.zeros(len(winding_counts), dtype=np.int32)
+    np.cumsum(winding_counts[:-1], out=loop_starts[1:])
+    loop_count = int(winding_counts.sum())
+
+    # Gather the loop vertex indices for all surfaces with the same winding count at once,
+    # each group is a (surfaces, count) block of windings reordered by one permutation
+    vertex_indices = np.empty(loop_count, dtype=np.int32)
+    for count in np.unique(winding_counts):
+        group = np.flatnonzero(winding_counts == count)
+        surf_indices = arrays.windings[
+            arrays.winding_starts[group, None] + winding_permutation(int(count))
+        ]
+        loop_idx = loop_starts[group, None] + np.arange(count)
+        vertex_indices[loop_idx] = surf_indices
 
-        uv_layer = me.uv_layers.active.data
+    # Loops are laid out in surface order, so the UVs can be computed for all of them
+    # at once with each surface's texgen repeated over its loops
+    loop_planes = arrays.texgen_planes[np.repeat(arrays.texgen_indices, winding_counts)]
+    surface_uvs = loop_uvs(pts[vertex_indices], loop_planes)
 
-        for i, poly in enumerate(me.polygons):
-            p: bpy.types.MeshPolygon = poly
-            p.material_index = face_texs[i]
-            
-            for j, loop_index in enumerate(p.loop_indices):
-                loop = me.loops[loop_index]
-                uv_layer[loop.index].uv = face_uvs[i][j]
+    fill_mesh(
+        me, pts, vertex_indices, loop_starts, winding_counts, arrays.texture_indices, surface_uvs
+    )
 
-    me.validate(verbose=True)
+    if validate_mesh:
+        me.validate(verbose=True)
     me.update()
 
     ob = bpy.data.objects.new("Object", me)
@@ -215,7 +171,8 @@ def load(
     use_groups_as_vgroups=False,
     use_cycles=True,
     relpath=None,
-    global_matrix=None
+    global_matrix=None,
+    validate_meshes=False
 ):
     """
     Called by the user interface or another script.
@@ -224,24 +181,28 @@ def load(
         to be split into objects and then converted into mesh objects
     """
 
-    dif = Dif.Load(str(filepath))
+    clear_import_caches()
+
+    # Read the whole file in one go, Dif.Load copies it over in small chunks
+    with open(filepath, "rb") as f:
+        dif = Dif.LoadFromByteArray(bytearray(f.read()))
 
     if global_matrix is None:
         global_matrix = mathutils.Matrix()
 
-    # deselect all
-    if bpy.ops.object.select_all.poll():
-        bpy.ops.object.select_all(action="DESELECT")
+    # deselect all, copied since deselecting changes the collection we iterate
+    for ob in list(context.view_layer.objects.selected):
+        ob.select_set(False)
 
     scene = context.scene
     new_objects = []  # put new objects here
 
     for interior in dif.interiors:
-        new_objects.append(create_mesh(filepath, interior))
+        new_objects.append(create_mesh(filepath, interior, validate_meshes))
 
     pathedInteriors: list[Object] = []
     for pathedInterior in dif.subObjects:
-        pathedInteriors.append(create_mesh(filepath, pathedInterior))
+        pathedInteriors.append(create_mesh(filepath, pathedInterior, validate_meshes))
 
     # Create new obj
     for obj in new_objects:
@@ -252,28 +213,34 @@ def load(
 
     for mover in dif.interiorPathfollowers:
         pos = mover.offset
-        itr = pathedInteriors[mover.interiorResIndex]
-        itr: Object = itr.copy()
+        # Movers sharing a sub-object get their own object around the same mesh
+        src = pathedInteriors[mover.interiorResIndex]
+        itr: Object = bpy.data.objects.new(src.name, src.data)
         base = scene.collection.objects.link(itr)
         itr.location = [pos.x, pos.y, pos.z]
         itr.dif_props.interior_type = "pathed_interior"
 
         waypoints: list[WayPoint] = mover.wayPoint
 
-        markerpts = [
-            (waypt.position.x, waypt.position.y, waypt.position.z)
-            for waypt in waypoints
-        ]
+        # NURBS points are (x, y, z, w)
+        markerpts = np.fromiter(
+            (
+                c
+                for waypt in waypoints
+                for c in (waypt.position.x, waypt.position.y, waypt.position.z, 1.0)
+            ),
+            dtype=np.float32,
+            count=4 * len(waypoints),
+        )
 
         curve = bpy.data.curves.new("markers", type="CURVE")
         curve.dimensions = "3D"
         spline = curve.splines.new(type="NURBS")
-        spline.points.add(len(markerpts) - 1)
+        spline.points.add(len(waypoints) - 1)
         spline.order_u = 2
         spline.resolution_u = 20
 
-        for p, new_co in zip(spline.points, markerpts):
-            p.co = new_co + (1.0,)
+        spline.points.foreach_set("co", markerpts)
 
         path = bpy.data.objects.new("path", curve)
         scene.collection.objects.link(path)
@@ -285,36 +252,25 @@ def load(
             g: GameEntity = ge
             gobj = bpy.data.objects.new(g.datablock, None)
             gobj.location = (g.position.x, g.position.y, g.position.z)
-            gobj.dif_props.interior_type = "game_entity"
-            gobj.dif_props.game_entity_datablock = g.datablock
-            gobj.dif_props.game_entity_gameclass = g.gameClass
-            for key in g.properties.h:
-                prop = gobj.dif_props.game_entity_properties.add()
+            dif_props = gobj.dif_props
+            dif_props.interior_type = "game_entity"
+            dif_props.game_entity_datablock = g.datablock
+            dif_props.game_entity_gameclass = g.gameClass
+            add_prop = dif_props.game_entity_properties.add
+            for key, value in g.properties.h.items():
+                prop = add_prop()
                 prop.key = key
-                prop.value = g.properties.get(key)
+                prop.value = value
             scene.collection.objects.link(gobj)
 
     context.view_layer.update()
 
-    axis_min = [1000000000] * 3
-    axis_max = [-1000000000] * 3
-
-    if global_clamp_size:
+    if global_clamp_size and new_objects:
         # Get all object bounds
-        for ob in new_objects:
-            for v in ob.bound_box:
-                for axis, value in enumerate(v):
-                    if axis_min[axis] > value:
-                        axis_min[axis] = value
-                    if axis_max[axis] < value:
-                        axis_max[axis] = value
+        axis_min, axis_max = aabb([ob.bound_box for ob in new_objects])
 
         # Scale objects
-        max_axis = max(
-            axis_max[0] - axis_min[0],
-            axis_max[1] - axis_min[1],
-            axis_max[2] - axis_min[2],
-        )
+        max_axis = float((axis_max - axis_min).max())
         scale = 1.0
 
         while global_clamp_size < max_axis * scale:
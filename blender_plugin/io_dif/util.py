@@ -4,8 +4,15 @@ from colorsys import hsv_to_rgb
 from itertools import count
 from fractions import Fraction
 
+import bpy
+import numpy as np
+
 texture_extensions = ("png", "jpg")
 
+# Checked once at import instead of for every mesh and material
+blender_4_0 = bpy.app.version >= (4, 0, 0)
+blender_4_1 = bpy.app.version >= (4, 1, 0)
+
 default_materials = {
     "black": (0, 0, 0),
     "black25": (191, 191, 191),
@@ -52,6 +59,92 @@ def resolve_texture(filepath, name):
         if prevdir == dirname:
             break
 
+def aabb(points):
+    """
+    Min and max corners of a bunch of (x, y, z) points, nested sequences such as
+    a list of bound boxes are flattened
+    """
+    points = np.asarray(points, dtype=np.float32).reshape(-1, 3)
+    return points.min(axis=0), points.max(axis=0)
+
+def fill_mesh(me, points, vertex_indices, loop_starts, loop_totals, material_indices, uvs):
+    """
+    Builds the mesh from flat arrays, the same layout from_pydata would produce
+    without going through Python sequences.
+    The indices are written as they come from the file, nothing checks them for range or
+    duplicates. The importers only run me.validate() afterwards when their "Validate Meshes"
+    option is set, turn it on for untrusted or malformed files so degenerate polygons and
+    bad indices get cleaned up.
+    """
+    me.vertices.add(len(points))
+    me.vertices.foreach_set("co", points.ravel())
+    me.loops.add(len(vertex_indices))
+    me.loops.foreach_set("vertex_index", vertex_indices)
+    me.polygons.add(len(loop_starts))
+    me.polygons.foreach_set("loop_start", loop_starts)
+    if not blender_4_0:
+        # Newer versions derive polygon sizes from loop_start, loop_total is read-only there
+        me.polygons.foreach_set("loop_total", loop_totals)
+    me.polygons.foreach_set("material_index", material_indices)
+    me.update(calc_edges=True)
+    if blender_4_1:
+        # Polygons are smooth unless marked sharp, from_pydata used to do this for us
+        me.shade_flat()
+
+    if not me.uv_layers:
+        me.uv_layers.new()
+    me.uv_layers.active.data.foreach_set("uv", uvs.ravel())
+
+# Materials and images created during the current import, cleared by clear_import_caches()
+material_cache: dict[str, bpy.types.Material] = {}
+image_cache: dict[str, bpy.types.Image] = {}
+
+def clear_import_caches():
+    material_cache.clear()
+    image_cache.clear()
+
+def load_image_cached(texname):
+    if texname in image_cache:
+        return image_cache[texname]
+    try:
+        teximg = bpy.data.images.load(texname)
+    except:
+        teximg = None
+        print("Cannot load image", texname)
+    image_cache[texname] = teximg
+    return teximg
+
+def new_textured_material(filepath, matname):
+    """
+    Creates a node material for matname and hooks its texture up if one can be found
+    """
+    mat = bpy.data.materials.new(matname)
+    mat.use_nodes = True
+    material_cache[matname] = mat
+
+    texname = resolve_texture(filepath, matname)
+    if texname is None:
+        return mat
+
+    teximg = load_image_cached(texname)
+    # Nothing to hook up if the image couldn't be loaded, keep the plain material
+    if teximg is None:
+        return mat
+
+    node_tree = mat.node_tree
+    principled = node_tree.nodes["Principled BSDF"]
+
+    texslot = node_tree.nodes.new("ShaderNodeTexImage")
+    texslot.name = matname
+    texslot.image = teximg
+    if not blender_4_0:
+        principled.inputs["Specular"].default_value = 0
+    else:
+        principled.inputs["Roughness"].default_value = 1.0
+    node_tree.links.new(principled.inputs["Base Color"], texslot.outputs["Color"])
+
+    return mat
+
 def fractions():
     yield 0
 